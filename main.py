@@ -1,71 +1,153 @@
-from dataclasses import dataclass, field
-from typing import Dict
-from pprint import pprint
-from copy import copy
+from dataclasses import InitVar, dataclass, field
+from functools import lru_cache
+from typing import NamedTuple
 from itertools import chain
+from operator import index
 
-from numpy_financial import pmt
-
+import numba
+import numpy as np
 
 CONFORMING_MAX = 776_250
 INTEREST_DEDUCTION_MAX_BALANCE = 750_000
 
 
-@dataclass(order=True)
+# explicit signatures compile these eagerly at import, with nper typed as int64
+@numba.njit("float64(float64, int64, float64)", cache=True)
+def _pmt_scalar(rate, nper, pv):
+    """Fixed payment for `pv` over `nper` periods; positive, unlike `pmt`."""
+    if rate == 0:
+        return pv / nper
+    # nper is int64, so numba compiles float ** int as exponentiation by
+    # squaring; a float exponent would switch this to a libm pow call
+    c = (1.0 + rate) ** nper
+    return pv * c * rate / (c - 1.0)
+
+
+@numba.njit(
+    "Tuple((float64, float64[:], float64[:], float64[:], float64[:]))"
+    "(float64, int64, float64)",
+    cache=True,
+    fastmath=True,
+)
+def _schedule(rate, nper, pv):
+    payment = _pmt_scalar(rate, nper, pv)
+    starting_balance = np.empty(nper)
+    interest = np.empty(nper)
+    principle = np.empty(nper)
+    cumulative_interest = np.empty(nper)
+    balance = pv
+    total_interest = 0.0
+    for k in range(nper):
+        starting_balance[k] = balance
+        i = balance * rate
+        p = payment - i
+        interest[k] = i
+        principle[k] = p
+        balance -= p
+        total_interest += i
+        cumulative_interest[k] = total_interest
+    return (
+        payment,
+        starting_balance,
+        interest,
+        principle,
+        cumulative_interest,
+    )
+
+
+class Schedule(NamedTuple):
+    payment: float
+    starting_balance: np.ndarray
+    interest: np.ndarray
+    principle: np.ndarray
+    ending_balance: np.ndarray
+    cumulative_interest: np.ndarray
+    total_interest: float
+
+    def scaled(self, loan_amounts):
+        """Yield this pv=1 schedule scaled to each of `loan_amounts`."""
+        # amortization is linear in pv, so one broadcast covers every amount
+        stacked = [np.multiply.outer(loan_amounts, x) for x in self]
+        for j in range(len(loan_amounts)):
+            payment, *arrays, total_interest = (x[j] for x in stacked)
+            yield Schedule(float(payment), *arrays, float(total_interest))
+
+
+@lru_cache(maxsize=256)
+def _build_schedule(rate, nper, pv):
+    """Amortization schedule at monthly `rate`; arrays are shared, so read-only."""
+    (
+        payment,
+        starting_balance,
+        interest,
+        principle,
+        cumulative_interest,
+    ) = _schedule(rate, nper, pv)
+    ending_balance = starting_balance - principle
+
+    arrays = (
+        starting_balance,
+        interest,
+        principle,
+        ending_balance,
+        cumulative_interest,
+    )
+    for a in arrays:
+        a.flags.writeable = False
+    return Schedule(payment, *arrays, float(cumulative_interest[-1]))
+
+
+def _crossover(cost, other_cost):
+    """First month the cheaper of two cumulative costs changes, else the term.
+
+    Works along the last axis, so a stack of costs can be scanned against
+    one baseline in a single call.
+    """
+    # ties go to `cost`, as min() of the two months would
+    other_cheaper = np.signbit(other_cost - cost)
+    flips = other_cheaper[..., 1:] != other_cheaper[..., :-1]
+    month = np.argmax(flips, axis=-1) + 1
+    return np.where(flips.any(axis=-1), month, other_cheaper.shape[-1])
+
+
+@dataclass(slots=True)
 class LoanMonth:
-    loan: "Loan" = field(repr=False, compare=False)
-    month_number: int = field(compare=False)
-    remaining_months: int = field(init=False, compare=False)
-    starting_balance: int = field(compare=False)
-    ending_balance: int = field(init=False, compare=False)
-    payment: int = field(init=False, compare=False)
-    principle: int = field(init=False, compare=False)
-    interest: int = field(init=False, compare=False)
-    deductible_interest: int = field(init=False, compare=False)
-    _prev_cumulative_principle: int = field(repr=False, compare=False)
-    _prev_cumulative_interest: int = field(repr=False, compare=False)
-    cumulative_principle: int = field(init=False, compare=False)
-    cumulative_interest: int = field(init=False, compare=False)
-    cumulative_cost: int = field(init=False, compare=True)
-
-    def __post_init__(self):
-        self.remaining_months = self.loan.years * 12 - self.month_number
-        self.payment = -pmt(
-            self.loan.interest_rate/12,
-            self.remaining_months,
-            self.starting_balance
-        )
-        self.interest = self.starting_balance * (self.loan.interest_rate/12)
-        self.deductible_interest = min(1, INTEREST_DEDUCTION_MAX_BALANCE/self.starting_balance) * self.interest
-        self.principle = self.payment - self.interest
-        self.ending_balance = self.starting_balance - self.principle
-        self.cumulative_principle = self._prev_cumulative_principle + self.principle
-        self.cumulative_interest = self._prev_cumulative_interest + self.interest
-        self.cumulative_cost = self.loan.upfront_cost + self.cumulative_interest + self.cumulative_principle
+    loan: "Loan" = field(repr=False)
+    month_number: int
+    remaining_months: int
+    starting_balance: int
+    ending_balance: int
+    payment: int
+    principle: int
+    interest: int
+    deductible_interest: int
+    cumulative_principle: int
+    cumulative_interest: int
+    cumulative_cost: int
 
     def __str__(self):
-        return super().__str__().replace(', ', ',\n     ')
-
-    @classmethod
-    def first_month(cls, loan: "Loan"):
-        m = cls(
-            loan=loan,
-            month_number=0,
-            starting_balance=loan.price - loan.down,
-            _prev_cumulative_principle=0,
-            _prev_cumulative_interest=0,
-        )
-        m.principle = m.principle + m.loan.down
-        return m
+        # super() breaks on slots=True dataclasses, which replace the class
+        return repr(self).replace(', ', ',\n     ')
 
     @classmethod
-    def build_from_month(cls, loan: "Loan", previous_month: "LoanMonth"):
+    def from_loan(cls, loan: "Loan", i: int):
+        principle = float(loan.principle[i])
+        if i == 0:
+            # the first month has always shown the down payment as principle
+            principle += loan.down
         return cls(
             loan=loan,
-            month_number=previous_month.month_number+1,
-            starting_balance=previous_month.ending_balance,
-            _prev_cumulative_principle=previous_month.cumulative_principle,
-            _prev_cumulative_interest=previous_month.cumulative_interest,
+            month_number=i,
+            remaining_months=loan._nper - i,
+            starting_balance=float(loan.starting_balance[i]),
+            ending_balance=float(loan.ending_balance[i]),
+            payment=loan.payment,
+            principle=principle,
+            interest=float(loan.interest[i]),
+            deductible_interest=float(loan.deductible_interest[i]),
+            cumulative_principle=loan.loan_amount - float(loan.ending_balance[i]),
+            cumulative_interest=float(loan.cumulative_interest[i]),
+            cumulative_cost=float(loan.cumulative_cost[i]),
         )
 
 
@@ -77,33 +159,55 @@ class Loan:
     interest_rate: float
     points: float
     name: str = None
+    # precomputed by escalation; not part of the public constructor
+    _schedule: InitVar[Schedule] = field(default=None, kw_only=True)
     down: int = field(init=False)
     closing_costs: int = field(init=False)
     loan_amount: int = field(init=False)
     points_fee: int = field(init=False)
+    upfront_cost: int = field(init=False, repr=False)
     total_interest: int = field(init=False)
     total_cost: int = field(init=False)
     payment: int = field(init=False)
     conforming: bool = field(init=False)
 
-    def __post_init__(self):
+    def __post_init__(self, _schedule=None):
         self.down = self.price * self.down_rate
         self.closing_costs = self.down + self.price * 0.03
         self.loan_amount = self.price - self.down
         self.points_fee = self.loan_amount * self.points * 0.01
+        self.upfront_cost = self.down + self.points_fee
         self.conforming = self.loan_amount <= CONFORMING_MAX
-
-        self.months = [
-            LoanMonth.first_month(self)
-        ]
-        for i in range(1, self.years * 12):
-            self.months.append(LoanMonth.build_from_month(
-                loan=self,
-                previous_month=self.months[i-1],
-            ))
-        self.total_interest = self.months[-1].cumulative_interest
-        self.total_cost = self.months[-1].cumulative_cost
-        self.payment = self.months[0].payment
+        self._monthly_rate = self.interest_rate / 12
+        self._nper = self.years * 12
+
+        schedule = _schedule
+        if schedule is None:
+            schedule = _build_schedule(
+                self._monthly_rate, self._nper, self.loan_amount
+            )
+        elif len(schedule.starting_balance) != self._nper:
+            raise ValueError('schedule does not match the loan term')
+        (
+            self.payment,
+            self.starting_balance,
+            self.interest,
+            self.principle,
+            self.ending_balance,
+            self.cumulative_interest,
+            self.total_interest,
+        ) = schedule
+        # principle paid so far is whatever has come off the balance
+        self.cumulative_cost = (
+            self.upfront_cost + self.cumulative_interest
+            + (self.loan_amount - self.ending_balance)
+        )
+        self.total_cost = float(self.cumulative_cost[-1])
+        # depends on the absolute balance, so not part of the shared schedule
+        self.deductible_interest = np.minimum(
+            1.0, INTEREST_DEDUCTION_MAX_BALANCE / self.starting_balance
+        ) * self.interest
+        self._months = None
 
     def __str__(self):
         return super().__str__().replace(', ', ',\n     ')
@@ -136,15 +240,37 @@ class Loan:
         return cls.buy_points(loan, -loan.points)
 
     @property
-    def upfront_cost(self):
-        return self.down + self.points_fee
+    def months(self):
+        """Every month as a `LoanMonth`, built on first access; see `month`."""
+        if self._months is None:
+            self._months = [self.month(i) for i in range(self._nper)]
+        return self._months
+
+    def month(self, i):
+        """Month `i` as a `LoanMonth`, built alone; integer indexes only."""
+        # index() raises TypeError for slices; take those from `months`
+        return LoanMonth.from_loan(self, range(self._nper)[index(i)])
 
     def compare_points(self, points):
-        other = self.__class__.buy_points(self, points)
-        return other.compare(self)
+        return self.compare_points_many([points])[0]
+
+    def compare_points_many(self, points):
+        points = list(points)
+        if not points:
+            return []
+        others = [self.__class__.buy_points(self, p) for p in points]
+        crossovers = _crossover(
+            np.stack([other.cumulative_cost for other in others]),
+            self.cumulative_cost,
+        )
+        return [
+            other.compare(self, int(crossover))
+            for other, crossover in zip(others, crossovers)
+        ]
 
-    def compare(self, other: "Loan"):
-        crossover = self.crossover(other)
+    def compare(self, other: "Loan", crossover=None):
+        if crossover is None:
+            crossover = self.crossover(other)
         upfront_cost_diff = self.upfront_cost - other.upfront_cost
         total_cost_diff = self.total_cost - other.total_cost
         reference_rate_of_return = (-total_cost_diff / upfront_cost_diff) ** (1/self.years)
@@ -163,21 +289,32 @@ class Loan:
         ).replace("$-", "-$")
 
     def crossover(self, other: "Loan"):
-        months = self.years * 12
-        min_loan = min(self.months[0], other.months[0]).loan
-        for month, other_month in zip(self.months, other.months):
-            next_min_loan = min(month, other_month).loan
-            if next_min_loan != min_loan:
-                return i
-        return months
+        # only the months both loans run can cross, as zip() over months did
+        months = min(self._nper, other._nper)
+        month = int(_crossover(
+            self.cumulative_cost[:months], other.cumulative_cost[:months]
+        ))
+        return self._nper if month == months else month
 
 
 def escalation(start_loan, stop_price, step):
-    for price in chain(range(start_loan.price, stop_price, step), [stop_price]):
-        loan = copy(start_loan)
-        loan.price = price
-        loan.__post_init__()
-        yield loan
+    prices = list(chain(range(start_loan.price, stop_price, step), [stop_price]))
+    # same arithmetic as Loan.loan_amount, which cumulative_cost relies on
+    loan_amounts = np.array(prices) - np.array(prices) * start_loan.down_rate
+    # read the live fields, which may have changed since __post_init__
+    unit = _build_schedule(
+        start_loan.interest_rate / 12, start_loan.years * 12, 1.0
+    )
+    for price, schedule in zip(prices, unit.scaled(loan_amounts)):
+        yield Loan(
+            price,
+            start_loan.down_rate,
+            start_loan.years,
+            start_loan.interest_rate,
+            start_loan.points,
+            start_loan.name,
+            _schedule=schedule,
+        )
 
 
 if __name__ == "__main__":
@@ -195,11 +332,8 @@ if __name__ == "__main__":
     # baseline = Loan.no_points(loan)
 
     # print(baseline)
-    # print(baseline.compare_points(-0.75))
-    # print(baseline.compare_points(0.75))
-    # print(baseline.compare_points(1.5))
-    # print(baseline.compare_points(2))
-    # print(baseline.compare_points(2.5))
+    # for comparison in baseline.compare_points_many([-0.75, 0.75, 1.5, 2, 2.5]):
+    #     print(comparison)
 
 
     # # compare min conforming vs 20% down
@@ -216,5 +350,6 @@ if __name__ == "__main__":
     # value_goal_post_remodel = total_loan / 0.8
     # loan = Loan(value_goal_post_remodel, 0.2, years, 0.03, 0.0)
     # print(loan)
-    # # for i in range(30):
-    #     print(i+1, sum(m.deductible_interest for m in loan.months[i*12:(i+1)*12]))
+    # annual_deductible_interest = loan.deductible_interest.reshape(years, 12).sum(axis=1)
+    # for i, deductible_interest in enumerate(annual_deductible_interest):
+    #     print(i+1, deductible_interest)